@@ -1,14 +1,102 @@
+import asyncio
+import base64
+import hashlib
+import io
 import os
-from typing import Optional
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Optional, Tuple, TypeVar
 
-from openai import OpenAI  # pip install openai
+import httpx
+import openai
+from openai import AsyncOpenAI  # pip install openai
+from PIL import Image  # pip install Pillow
+
+try:
+    from . import db
+except ImportError:  # Allows running as a script from backend/ during dev
+    import db
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ALTGEN_MODEL = os.getenv("ALTGEN_MODEL", "gpt-4o-mini")
 
-_client: Optional[OpenAI] = None
-if OPENAI_API_KEY:
-    _client = OpenAI(api_key=OPENAI_API_KEY)
+# Bump whenever the prompt changes so cached suggestions are regenerated
+PROMPT_VERSION = 1
+
+_SYSTEM_MSG = {
+    "role": "system",
+    "content": (
+        "You generate high-quality accessibility alt-text for images. "
+        "Be concrete and neutral, avoid guessing unknown details."
+    ),
+}
+
+# The post context is appended to this for each image
+_USER_PREFIX = (
+    "Write concise, objective alt-text for this image for a blind screen-reader user. "
+    "Maximum 2 sentences. Do not start with phrases like 'Image of' or 'Photo of'; "
+    "just describe the key visual content and any text in the image. "
+    "Here is optional context from the post: "
+)
+
+_CONTEXT_MAX_CHARS = 220
+
+# Starting number of alt-text requests in flight during a scan; the
+# AdaptiveLimiter grows or shrinks this based on observed latency and 429s.
+ALTGEN_CONCURRENCY = int(os.getenv("ALTGEN_CONCURRENCY", "10"))
+
+# Optional account limits (requests / tokens per minute); unset disables
+# client-side rate limiting.
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "0"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "0"))
+
+# Tokens billed for one detail="low" image input
+_LOW_DETAIL_IMAGE_TOKENS = 85
+_MAX_COMPLETION_TOKENS = 120
+
+# Status codes worth retrying; anything else is treated as a hard failure
+_RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+# Treat a response as throttled once fewer than this fraction of the
+# per-minute request budget remains, so the pool backs off before a 429.
+_RATELIMIT_LOW_WATERMARK = 0.1
+
+# Images are shrunk to fit this box and re-encoded before upload; the model
+# bills per image tile, so smaller images are both cheaper and faster.
+_MAX_IMAGE_SIDE = 1024
+_JPEG_QUALITY = 80
+
+T = TypeVar("T")
+
+# Shared HTTP session for downloading images from the Bluesky CDN, and the
+# OpenAI client; both are created by start() and closed by aclose().
+_http: Optional[httpx.AsyncClient] = None
+_client: Optional[AsyncOpenAI] = None
+
+# Bounds concurrent image downloads/resizes, which happen before (and
+# independently of) the AdaptiveLimiter permit for the OpenAI call.
+_fetch_sem: Optional[asyncio.Semaphore] = None
+
+# Client-side RPM/TPM pacing, created by start() when a limit is configured
+_rate_limiter: Optional["SlidingLimiter"] = None
+
+
+def start() -> None:
+    """
+    Create the shared image-download session, the OpenAI client and the
+    rate limiter. Called from the app's lifespan hook, so each startup gets
+    fresh clients and loop-bound primitives.
+    """
+    global _http, _client, _fetch_sem, _rate_limiter
+    _http = httpx.AsyncClient(limits=httpx.Limits(max_connections=32), timeout=15)
+    _fetch_sem = asyncio.Semaphore(ALTGEN_CONCURRENCY)
+    if OPENAI_RPM or OPENAI_TPM:
+        _rate_limiter = SlidingLimiter(OPENAI_RPM, OPENAI_TPM)
+    if OPENAI_API_KEY:
+        # Retries are handled by _call_with_retry; SDK retries would stack on
+        # top of ours and hide 429s from the AdaptiveLimiter.
+        _client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
 
 
 def is_enabled() -> bool:
@@ -18,10 +106,276 @@ def is_enabled() -> bool:
     return _client is not None
 
 
-def generate_alt_text(image_url: str, post_text: Optional[str] = None) -> Optional[str]:
+async def aclose() -> None:
+    """
+    Close the shared image-download session and the OpenAI client, and
+    drop the state start() created.
+    """
+    global _http, _client, _fetch_sem, _rate_limiter
+    if _http:
+        await _http.aclose()
+    if _client:
+        await _client.close()
+    _http = _client = _fetch_sem = _rate_limiter = None
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter for alt-text requests.
+
+    Admits at most `limit` coroutines at once, with the limit adjusted at
+    runtime: it grows by alpha per healthy request completed while the
+    limiter is saturated, and is multiplied by beta when the API throttles
+    us (429) or the mean latency of the last `window` requests exceeds
+    target_latency. A lowered limit takes effect immediately for new work.
+    """
+
+    def __init__(
+        self,
+        initial: int = ALTGEN_CONCURRENCY,
+        c_min: int = 2,
+        c_max: int = 64,
+        alpha: float = 0.5,
+        beta: float = 0.5,
+        target_latency: float = 3.0,
+        window: int = 32,
+    ) -> None:
+        self.c_min = c_min
+        self.c_max = c_max
+        self.alpha = alpha
+        self.beta = beta
+        self.target_latency = target_latency
+
+        self._c = float(max(c_min, min(c_max, initial)))
+        self._limit = int(self._c)
+        self._in_flight = 0
+        self._cond = asyncio.Condition()
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._throttled = False
+        self._last_decrease = 0.0
+
+    def record_throttle(self) -> None:
+        """Note a 429; the next completed request will lower the limit."""
+        self._throttled = True
+
+    async def run(self, coro: Awaitable[T]) -> T:
+        """Await coro while holding a permit, feeding its latency back in."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < self._limit)
+            self._in_flight += 1
+        started = time.monotonic()
+        try:
+            return await coro
+        finally:
+            self._latencies.append(time.monotonic() - started)
+            self._update()
+            self._in_flight -= 1
+            async with self._cond:
+                self._cond.notify_all()
+
+    def _update(self) -> None:
+        now = time.monotonic()
+        mean_latency = sum(self._latencies) / len(self._latencies)
+        congested = self._throttled or mean_latency > self.target_latency
+        self._throttled = False
+
+        if congested:
+            # Back off at most once per target_latency so a burst of
+            # concurrent failures doesn't collapse the limit to c_min.
+            if now - self._last_decrease < self.target_latency:
+                return
+            self._last_decrease = now
+            self._c = max(self.c_min, self._c * self.beta)
+        elif self._in_flight >= self._limit:
+            # Only grow while every permit is in use, so an idle limiter
+            # doesn't drift up to c_max
+            self._c = min(self.c_max, self._c + self.alpha)
+
+        self._limit = int(self._c)
+
+
+class SlidingLimiter:
+    """
+    Sliding 60-second window limiter for requests and tokens per minute.
+
+    acquire() waits until sending one more request with the given token
+    estimate would keep both counts under their limits. A limit of 0
+    disables that dimension.
+    """
+
+    WINDOW_SECONDS = 60.0
+
+    def __init__(self, rpm: int, tpm: int) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+        self.req_times: Deque[float] = deque()
+        self.tok_times: Deque[Tuple[float, int]] = deque()
+        self._tokens_in_window = 0
+        self._lock = asyncio.Lock()
+
+    def _evict(self, now: float) -> None:
+        cutoff = now - self.WINDOW_SECONDS
+        while self.req_times and self.req_times[0] <= cutoff:
+            self.req_times.popleft()
+        while self.tok_times and self.tok_times[0][0] <= cutoff:
+            self._tokens_in_window -= self.tok_times.popleft()[1]
+
+    def _wait_time(self, now: float, est_tokens: int) -> float:
+        wait = 0.0
+        if self.rpm and len(self.req_times) >= self.rpm:
+            wait = self.req_times[0] + self.WINDOW_SECONDS - now
+        if (
+            self.tpm
+            and self.tok_times
+            and self._tokens_in_window + est_tokens > self.tpm
+        ):
+            # Wait for enough of the oldest entries to age out. A request
+            # larger than the whole budget waits for an empty window.
+            est_tokens = min(est_tokens, self.tpm)
+            freed = 0
+            for t, tokens in self.tok_times:
+                freed += tokens
+                if self._tokens_in_window - freed + est_tokens <= self.tpm:
+                    wait = max(wait, t + self.WINDOW_SECONDS - now)
+                    break
+        return wait
+
+    async def acquire(self, est_tokens: int) -> None:
+        # Serialize waiters so requests are admitted in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._evict(now)
+                wait = self._wait_time(now, est_tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            self.req_times.append(now)
+            self.tok_times.append((now, est_tokens))
+            self._tokens_in_window += est_tokens
+
+
+def _retry_after_seconds(e: Exception) -> Optional[float]:
+    """Return the server-requested wait from a Retry-After header, if any."""
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def _ratelimit_low(headers: Any) -> bool:
+    """
+    Return True when the x-ratelimit headers show the request budget is
+    nearly spent, so callers can back off before hitting a 429.
+    """
+    try:
+        remaining = int(headers.get("x-ratelimit-remaining-requests"))
+        limit = int(headers.get("x-ratelimit-limit-requests"))
+    except (TypeError, ValueError):
+        return False
+    return limit > 0 and remaining < limit * _RATELIMIT_LOW_WATERMARK
+
+
+async def _call_with_retry(
+    fn: Callable[..., Awaitable[Any]],
+    *args: Any,
+    max_attempts: int = 3,
+    base: float = 1.0,
+    cap: float = 15.0,
+    on_throttle: Optional[Callable[[], None]] = None,
+    **kwargs: Any,
+) -> Any:
+    """
+    Await fn(*args, **kwargs), retrying transient OpenAI failures
+    (rate limits, 5xx, connection errors) with jittered exponential backoff.
+    The last error is re-raised once max_attempts is exhausted.
+
+    on_throttle, if given, is called for every 429 seen.
+    """
+    for attempt in range(max_attempts - 1):
+        try:
+            return await fn(*args, **kwargs)
+        except openai.RateLimitError as e:
+            if on_throttle:
+                on_throttle()
+            delay = _retry_after_seconds(e)
+        except openai.APIStatusError as e:
+            if e.status_code not in _RETRYABLE_STATUS:
+                raise
+            if e.status_code == 429 and on_throttle:
+                on_throttle()
+            delay = None
+        except openai.APIConnectionError:
+            delay = None
+
+        if delay is None:
+            delay = base * 2**attempt + random.uniform(0, 0.25)
+        await asyncio.sleep(min(cap, delay))
+
+    return await fn(*args, **kwargs)
+
+
+def _cache_key(image_url: str, image_cid: Optional[str]) -> str:
+    # Prefer the blob CID: it identifies the image bytes and survives CDN
+    # URL changes, whereas the URL is only a fallback.
+    ident = image_cid or image_url
+    return hashlib.sha256(
+        f"{ALTGEN_MODEL}|{PROMPT_VERSION}|{ident}".encode()
+    ).hexdigest()
+
+
+def _downscale(data: bytes) -> bytes:
+    """Fit an image within _MAX_IMAGE_SIDE and re-encode it as JPEG."""
+    img = Image.open(io.BytesIO(data)).convert("RGB")
+    img.thumbnail((_MAX_IMAGE_SIDE, _MAX_IMAGE_SIDE), Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=_JPEG_QUALITY, optimize=True)
+    return buf.getvalue()
+
+
+async def _fetch_image(image_url: str) -> Tuple[bytes, str]:
+    """Download an image and downscale it for upload as (bytes, content type)."""
+    async with _fetch_sem:
+        r = await _http.get(image_url)
+        r.raise_for_status()
+        try:
+            # Decoding/resizing is CPU-bound; keep it off the event loop
+            return await asyncio.to_thread(_downscale, r.content), "image/jpeg"
+        except Exception as e:
+            print(f"[alt_text_gen] Could not downscale {image_url}, sending as-is: {e}")
+            content_type = r.headers.get("content-type", "image/jpeg").split(";")[0]
+            return r.content, content_type
+
+
+def _data_url(data: bytes, content_type: str) -> str:
+    return f"data:{content_type};base64,{base64.b64encode(data).decode()}"
+
+
+async def generate_alt_text_async(
+    image_url: str,
+    post_text: Optional[str] = None,
+    limiter: Optional[AdaptiveLimiter] = None,
+    image_cid: Optional[str] = None,
+) -> Optional[str]:
     """
     Generate concise alt-text for the given image URL using an OpenAI
-    vision-capable chat model (e.g. gpt-4o / gpt-4o-mini).
+    vision-capable chat model (e.g. gpt-4o / gpt-4o-mini). The image is
+    downloaded here, downscaled, and sent inline as a low-detail data URL, so
+    OpenAI doesn't have to fetch it from the CDN itself.
+
+    Results are cached in SQLite keyed by model, prompt version and the
+    image's blob CID (or URL when no CID is known), so re-scans don't call
+    the API again. If limiter is given, each OpenAI call holds one of its
+    permits (backoff sleeps don't) and rate-limit responses are reported to
+    it, along with responses showing the request budget is nearly spent, so
+    it can shrink its concurrency.
 
     Returns a 1–2 sentence description, or None on error.
     """
@@ -29,43 +383,70 @@ def generate_alt_text(image_url: str, post_text: Optional[str] = None) -> Option
         return None
 
     context_snippet = (post_text or "").strip()
-    if len(context_snippet) > 220:
-        context_snippet = context_snippet[:220] + "…"
-
-    user_prompt = (
-        "Write concise, objective alt-text for this image for a blind screen-reader user. "
-        "Maximum 2 sentences. Do not start with phrases like 'Image of' or 'Photo of'; "
-        "just describe the key visual content and any text in the image. "
-        f"Here is optional context from the post: {context_snippet or '(no extra context)'}"
-    )
+    if len(context_snippet) > _CONTEXT_MAX_CHARS:
+        context_snippet = context_snippet[:_CONTEXT_MAX_CHARS] + "…"
 
     try:
-        resp = _client.chat.completions.create(
+        cache_key = _cache_key(image_url, image_cid)
+        cached = await asyncio.to_thread(db.altgen_cache_get, cache_key)
+        if cached:
+            return cached
+
+        image_bytes, content_type = await _fetch_image(image_url)
+
+        user_text = _USER_PREFIX + (context_snippet or "(no extra context)")
+        est_tokens = (
+            (len(_SYSTEM_MSG["content"]) + len(user_text)) // 4
+            + _LOW_DETAIL_IMAGE_TOKENS
+            + _MAX_COMPLETION_TOKENS
+        )
+
+        async def _create(**kwargs: Any) -> Any:
+            # Every attempt counts against the RPM/TPM window; wait for it
+            # before taking a limiter permit so pacing isn't seen as latency.
+            if _rate_limiter:
+                await _rate_limiter.acquire(est_tokens)
+            call = _client.chat.completions.with_raw_response.create(**kwargs)
+            if not limiter:
+                return await call
+            return await limiter.run(_with_backpressure(call))
+
+        async def _with_backpressure(call: Awaitable[Any]) -> Any:
+            # Runs while the permit is held, so a nearly spent request budget
+            # lowers the limit for the whole pool, not just this job.
+            raw = await call
+            if _ratelimit_low(raw.headers):
+                limiter.record_throttle()
+            return raw
+
+        raw = await _call_with_retry(
+            _create,
+            on_throttle=limiter.record_throttle if limiter else None,
             model=ALTGEN_MODEL,
             messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You generate high-quality accessibility alt-text for images. "
-                        "Be concrete and neutral, avoid guessing unknown details."
-                    ),
-                },
+                _SYSTEM_MSG,
                 {
                     "role": "user",
                     "content": [
-                        {"type": "text", "text": user_prompt},
+                        {"type": "text", "text": user_text},
                         {
                             "type": "image_url",
-                            "image_url": {"url": image_url},
+                            "image_url": {
+                                "url": _data_url(image_bytes, content_type),
+                                "detail": "low",
+                            },
                         },
                     ],
                 },
             ],
-            max_tokens=120,
+            max_tokens=_MAX_COMPLETION_TOKENS,
             temperature=0.2,
         )
-        text = resp.choices[0].message.content or ""
-        return text.strip() or None
+        resp = raw.parse()
+        text = (resp.choices[0].message.content or "").strip()
+        if text:
+            await asyncio.to_thread(db.altgen_cache_put, cache_key, text)
+        return text or None
     except Exception as e:
         print(f"[alt_text_gen] Error generating alt-text: {e}")
-        return None
\ No newline at end of file
+        return None
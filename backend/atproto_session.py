@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import hmac
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+
+from atproto import AsyncClient, Session, SessionEvent
+from atproto.exceptions import BadRequestError, UnauthorizedError
+
+# Reuse a cached session for just under the access token's refresh window
+SESSION_TTL_SECONDS = 3300
+
+# XRPC error names the PDS uses for a revoked or expired session
+_AUTH_ERRORS = ("ExpiredToken", "InvalidToken", "AuthRequired", "AuthMissing")
+
+# Set while a _SessionClient request is in flight in this task, so nested
+# calls (token refresh, the fallback login) skip the fallback logic
+_in_request: ContextVar[bool] = ContextVar("_in_request", default=False)
+
+# handle -> (session string, app password digest, time cached)
+_sessions: Dict[str, Tuple[str, bytes, float]] = {}
+
+
+def _password_digest(app_password: str) -> bytes:
+    return hashlib.sha256(app_password.encode()).digest()
+
+
+def _is_auth_error(e: Exception) -> bool:
+    if isinstance(e, UnauthorizedError):
+        return True
+    if isinstance(e, BadRequestError):
+        content = getattr(e.response, "content", None)
+        return getattr(content, "error", None) in _AUTH_ERRORS
+    return False
+
+
+class _SessionClient(AsyncClient):
+    """
+    AsyncClient whose new or refreshed sessions update the cache.
+
+    When resumed from a cached session, it keeps the app password until its
+    first request succeeds; if that request is rejected with an auth error,
+    it drops the cache entry, logs in with the password and retries once.
+    """
+
+    def __init__(self, handle: str, digest: bytes) -> None:
+        super().__init__()
+        self._handle = handle
+        self._digest = digest
+        self._fallback_password: Optional[str] = None
+        self._relogin_lock = asyncio.Lock()
+        self.on_session_change(self._on_session_change)
+
+    def _on_session_change(self, event: SessionEvent, session: Session) -> None:
+        if event in (SessionEvent.CREATE, SessionEvent.REFRESH):
+            _sessions[self._handle] = (session.encode(), self._digest, time.time())
+
+    async def _invoke(self, invoke_type: Any, **kwargs: Any) -> Any:
+        if _in_request.get():
+            return await super()._invoke(invoke_type, **kwargs)
+        token = _in_request.set(True)
+        try:
+            return await self._invoke_with_fallback(invoke_type, **kwargs)
+        finally:
+            _in_request.reset(token)
+
+    async def _invoke_with_fallback(self, invoke_type: Any, **kwargs: Any) -> Any:
+        password = self._fallback_password
+        try:
+            response = await super()._invoke(invoke_type, **kwargs)
+        except Exception as e:
+            if password is None or not _is_auth_error(e):
+                raise
+            print(f"[atproto_session] Cached session for {self._handle} rejected: {e}")
+            await self._relogin(password)
+            return await super()._invoke(invoke_type, **kwargs)
+        # The resumed session works; later auth errors are real failures
+        self._fallback_password = None
+        return response
+
+    async def _relogin(self, password: str) -> None:
+        async with self._relogin_lock:
+            # Another concurrent request already logged in again
+            if self._fallback_password is None:
+                return
+            self._fallback_password = None
+            _sessions.pop(self._handle, None)
+            await self.login(self._handle, password, fetch_bsky_profile=False)
+
+
+async def get_client(handle: str, app_password: str) -> AsyncClient:
+    """
+    Return a logged-in AsyncClient for handle, resuming a recently cached
+    session instead of doing a full password login when possible.
+
+    A cached session is only reused when the same app password is supplied.
+    Resuming makes no request up front; atproto refreshes the access token
+    as needed, and if the PDS rejects the session on the first call the
+    client logs in with the password and retries. Raises whatever
+    client.login raises if a password login fails.
+    """
+    digest = _password_digest(app_password)
+
+    cached = _sessions.get(handle)
+    if cached is not None:
+        session_string, cached_digest, ts = cached
+        # A wrong password must not evict the real user's session
+        if hmac.compare_digest(digest, cached_digest):
+            if time.time() - ts < SESSION_TTL_SECONDS:
+                client = _SessionClient(handle, digest)
+                try:
+                    await client.login(
+                        session_string=session_string, fetch_bsky_profile=False
+                    )
+                    client._fallback_password = app_password
+                    return client
+                except Exception as e:
+                    print(
+                        f"[atproto_session] Cached session for {handle} rejected: {e}"
+                    )
+            _sessions.pop(handle, None)
+
+    client = _SessionClient(handle, digest)
+    await client.login(handle, app_password, fetch_bsky_profile=False)
+    return client
@@ -1,181 +1,252 @@
 import os
 import sqlite3
-from typing import List, Dict, Any
+from typing import List, Optional, Tuple
+
+try:
+    from .db_pool import ConnectionPool
+except ImportError:  # Allows running as a script from backend/ during dev
+    from db_pool import ConnectionPool
 
 DB_PATH = os.getenv(
     "ALTTS_DB_PATH",
     os.path.join(os.path.dirname(__file__), "alttext_slinger.db"),
 )
 
+# Rows per executemany call when bulk-writing image rows in save_scan_page
+SAVE_BATCH_SIZE = 500
+
+# Prepared statements kept per connection by sqlite3's statement cache.
+# Hot-path SQL lives in module constants below so every call passes the
+# identical string and hits that cache instead of re-compiling.
+STATEMENT_CACHE_SIZE = 256
+
+USERS_INSERT_SQL = "INSERT OR IGNORE INTO users(handle) VALUES (?)"
+
+POSTS_UPSERT_SQL = """
+    INSERT INTO posts (handle, uri, cid, text, created_at, has_images)
+    VALUES (?, ?, ?, ?, ?, 1)
+    ON CONFLICT(handle, uri) DO UPDATE SET
+        cid = excluded.cid,
+        text = excluded.text,
+        created_at = excluded.created_at,
+        has_images = excluded.has_images;
+"""
+
+IMAGES_SCAN_UPSERT_SQL = """
+    INSERT INTO images (
+        handle, post_uri, image_index,
+        thumb_url, fullsize_url,
+        current_alt, generated_alt, last_status
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, 'scanned')
+    ON CONFLICT(handle, post_uri, image_index) DO UPDATE SET
+        thumb_url = excluded.thumb_url,
+        fullsize_url = excluded.fullsize_url,
+        current_alt = excluded.current_alt,
+        generated_alt = excluded.generated_alt,
+        last_status = 'scanned',
+        updated_at = datetime('now');
+"""
+
+IMAGE_APPLIED_UPSERT_SQL = """
+    INSERT INTO images (
+        handle, post_uri, image_index,
+        current_alt, last_applied_alt, last_status
+    )
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(handle, post_uri, image_index) DO UPDATE SET
+        current_alt = excluded.current_alt,
+        last_applied_alt = excluded.last_applied_alt,
+        last_status = excluded.last_status,
+        updated_at = datetime('now');
+"""
+
+ALTGEN_CACHE_GET_SQL = "SELECT alt FROM altgen_cache WHERE key = ?"
+
+ALTGEN_CACHE_PUT_SQL = """
+    INSERT INTO altgen_cache (key, alt)
+    VALUES (?, ?)
+    ON CONFLICT(key) DO NOTHING;
+"""
+
+
+def _apply_pragmas(conn: sqlite3.Connection) -> None:
+    """
+    Tune a fresh connection: WAL so readers don't block on the writer,
+    NORMAL sync (safe under WAL) to avoid an fsync per commit, plus larger
+    page cache / mmap and a busy timeout instead of immediate lock errors.
+    """
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA mmap_size=268435456;")
+    conn.execute("PRAGMA cache_size=-65536;")
+    conn.execute("PRAGMA busy_timeout=5000;")
+
 
 def _get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+    # isolation_level=None: autocommit unless a transaction is opened
+    # explicitly with BEGIN (see save_scan_page).
+    conn = sqlite3.connect(
+        DB_PATH,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
     conn.row_factory = sqlite3.Row
+    _apply_pragmas(conn)
     return conn
 
 
+# Long-lived connections shared by all callers in this process
+_pool = ConnectionPool(_get_conn, maxsize=8)
+
+
 def init_db() -> None:
-    conn = _get_conn()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            handle TEXT PRIMARY KEY,
-            created_at TEXT DEFAULT (datetime('now'))
-        );
-        """
-    )
+    with _pool.acquire() as conn:
+        cur = conn.cursor()
 
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS posts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            handle TEXT NOT NULL,
-            uri TEXT NOT NULL,
-            cid TEXT,
-            text TEXT,
-            created_at TEXT,
-            has_images INTEGER NOT NULL DEFAULT 1,
-            UNIQUE(handle, uri)
-        );
-        """
-    )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                handle TEXT PRIMARY KEY,
+                created_at TEXT DEFAULT (datetime('now'))
+            );
+            """
+        )
 
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            handle TEXT NOT NULL,
-            post_uri TEXT NOT NULL,
-            image_index INTEGER NOT NULL,
-            thumb_url TEXT,
-            fullsize_url TEXT,
-            current_alt TEXT,
-            generated_alt TEXT,
-            last_applied_alt TEXT,
-            last_status TEXT,
-            updated_at TEXT DEFAULT (datetime('now')),
-            UNIQUE(handle, post_uri, image_index)
-        );
-        """
-    )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                handle TEXT NOT NULL,
+                uri TEXT NOT NULL,
+                cid TEXT,
+                text TEXT,
+                created_at TEXT,
+                has_images INTEGER NOT NULL DEFAULT 1,
+                UNIQUE(handle, uri)
+            );
+            """
+        )
+
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                handle TEXT NOT NULL,
+                post_uri TEXT NOT NULL,
+                image_index INTEGER NOT NULL,
+                thumb_url TEXT,
+                fullsize_url TEXT,
+                current_alt TEXT,
+                generated_alt TEXT,
+                last_applied_alt TEXT,
+                last_status TEXT,
+                updated_at TEXT DEFAULT (datetime('now')),
+                UNIQUE(handle, post_uri, image_index)
+            );
+            """
+        )
+
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS altgen_cache (
+                key TEXT PRIMARY KEY,
+                alt TEXT,
+                created_at TEXT DEFAULT (datetime('now'))
+            );
+            """
+        )
 
-    conn.commit()
-    conn.close()
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_images_handle ON images(handle);")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_images_post_uri ON images(post_uri);")
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_posts_handle_created "
+            "ON posts(handle, created_at DESC);"
+        )
 
+        # Refresh planner statistics so the indexes above get used
+        cur.execute("ANALYZE;")
 
-def save_scan(handle: str, posts: List[Dict[str, Any]]) -> None:
-    """
-    Persist scan results to SQLite.
 
-    posts: list of dicts shaped like PostInfo.model_dump()
+def altgen_cache_get(key: str) -> Optional[str]:
+    """
+    Return a previously generated alt-text for this cache key, if any.
     """
-    conn = _get_conn()
-    cur = conn.cursor()
+    with _pool.acquire() as conn:
+        cur = conn.cursor()
 
-    cur.execute("INSERT OR IGNORE INTO users(handle) VALUES (?)", (handle,))
+        cur.execute(ALTGEN_CACHE_GET_SQL, (key,))
+        row = cur.fetchone()
 
-    for post in posts:
-        uri = post["uri"]
-        cid = post.get("cid")
-        text = post.get("text")
-        created_at = post.get("created_at")
+    return row["alt"] if row else None
 
-        cur.execute(
-            """
-            INSERT INTO posts (handle, uri, cid, text, created_at, has_images)
-            VALUES (?, ?, ?, ?, ?, 1)
-            ON CONFLICT(handle, uri) DO UPDATE SET
-                cid = excluded.cid,
-                text = excluded.text,
-                created_at = excluded.created_at,
-                has_images = excluded.has_images;
-            """,
-            (handle, uri, cid, text, created_at),
-        )
 
-        for img in post.get("images", []):
-            idx = img["index"]
-            thumb_url = img.get("thumb_url")
-            fullsize_url = img.get("fullsize_url")
-            current_alt = img.get("alt")
-            generated_alt = img.get("generated_alt")
-
-            cur.execute(
-                """
-                INSERT INTO images (
-                    handle, post_uri, image_index,
-                    thumb_url, fullsize_url,
-                    current_alt, generated_alt, last_status
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, 'scanned')
-                ON CONFLICT(handle, post_uri, image_index) DO UPDATE SET
-                    thumb_url = excluded.thumb_url,
-                    fullsize_url = excluded.fullsize_url,
-                    current_alt = excluded.current_alt,
-                    generated_alt = excluded.generated_alt,
-                    last_status = 'scanned',
-                    updated_at = datetime('now');
-                """,
-                (
-                    handle,
-                    uri,
-                    idx,
-                    thumb_url,
-                    fullsize_url,
-                    current_alt,
-                    generated_alt,
-                ),
-            )
-
-    conn.commit()
-    conn.close()
-
-
-def record_image_update(
+def altgen_cache_put(key: str, alt: str) -> None:
+    """
+    Store a generated alt-text; an existing entry for the key is kept.
+    """
+    with _pool.acquire() as conn:
+        cur = conn.cursor()
+
+        cur.execute(ALTGEN_CACHE_PUT_SQL, (key, alt))
+
+
+def save_scan_page(
     handle: str,
-    uri: str,
-    image_index: int,
-    new_alt: str,
-    status: str,
+    post_rows: List[Tuple[str, str, str, str, Optional[str]]],
+    image_rows: List[Tuple[str, str, int, str, str, Optional[str], Optional[str]]],
 ) -> None:
     """
-    Record that an image alt was applied (or failed).
+    Persist one page of scan results to SQLite.
+
+    post_rows: (handle, uri, cid, text, created_at) tuples
+    image_rows: (handle, post_uri, image_index, thumb_url, fullsize_url,
+                 current_alt, generated_alt) tuples
     """
-    conn = _get_conn()
-    cur = conn.cursor()
-
-    cur.execute(
-        """
-        UPDATE images
-        SET
-            current_alt = ?,
-            last_applied_alt = ?,
-            last_status = ?,
-            updated_at = datetime('now')
-        WHERE handle = ? AND post_uri = ? AND image_index = ?;
-        """,
-        (new_alt, new_alt, status, handle, uri, image_index),
-    )
+    with _pool.acquire() as conn:
+        cur = conn.cursor()
 
-    # If no row existed (unlikely but possible), insert one
-    if cur.rowcount == 0:
-        cur.execute(
-            """
-            INSERT INTO images (
-                handle, post_uri, image_index,
-                current_alt, last_applied_alt, last_status
-            )
-            VALUES (?, ?, ?, ?, ?, ?)
-            ON CONFLICT(handle, post_uri, image_index) DO UPDATE SET
-                current_alt = excluded.current_alt,
-                last_applied_alt = excluded.last_applied_alt,
-                last_status = excluded.last_status,
-                updated_at = datetime('now');
-            """,
-            (handle, uri, image_index, new_alt, new_alt, status),
-        )
+        try:
+            cur.execute("BEGIN")
+
+            cur.execute(USERS_INSERT_SQL, (handle,))
+            cur.executemany(POSTS_UPSERT_SQL, post_rows)
 
-    conn.commit()
-    conn.close()
\ No newline at end of file
+            for start in range(0, len(image_rows), SAVE_BATCH_SIZE):
+                cur.executemany(
+                    IMAGES_SCAN_UPSERT_SQL,
+                    image_rows[start : start + SAVE_BATCH_SIZE],
+                )
+
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+
+
+def record_image_updates_bulk(rows: List[Tuple[str, str, int, str, str]]) -> None:
+    """
+    Record many applied (or failed) alt updates in one transaction.
+
+    rows: (handle, uri, image_index, new_alt, status) tuples
+    """
+    if not rows:
+        return
+
+    params = [
+        (handle, uri, image_index, new_alt, new_alt, status)
+        for handle, uri, image_index, new_alt, status in rows
+    ]
+
+    with _pool.acquire() as conn:
+        cur = conn.cursor()
+
+        try:
+            cur.execute("BEGIN")
+            cur.executemany(IMAGE_APPLIED_UPSERT_SQL, params)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
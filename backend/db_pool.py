@@ -0,0 +1,60 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+
+class ConnectionPool:
+    """
+    A small process-wide pool of long-lived SQLite connections.
+
+    Connections are created lazily by `factory` up to `maxsize` and handed
+    back to the pool after use, so their page cache and statement cache
+    survive across requests instead of being rebuilt on every call.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], sqlite3.Connection],
+        maxsize: int = 8,
+    ) -> None:
+        self._factory = factory
+        self._maxsize = maxsize
+        self._idle: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=maxsize)
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _get(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self._maxsize:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        return self._idle.get()
+
+    @contextmanager
+    def acquire(self) -> Iterator[sqlite3.Connection]:
+        conn = self._get()
+        try:
+            yield conn
+        finally:
+            # Never hand a connection with an open transaction to the next user
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
@@ -1,20 +1,39 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing, asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import AsyncIterator, List, Optional, Dict, Tuple
 
-from atproto import Client
+import orjson
+from atproto import AsyncClient
 
 try:
-    from .alt_text_gen import is_enabled as altgen_is_enabled, generate_alt_text
+    from .alt_text_gen import (
+        AdaptiveLimiter,
+        is_enabled as altgen_is_enabled,
+        generate_alt_text_async,
+        aclose as altgen_aclose,
+        start as altgen_start,
+    )
     from . import db
+    from .atproto_session import get_client
 except ImportError:  # Allows running as a script from backend/ during dev
     import os
     import sys
 
     sys.path.append(os.path.dirname(__file__))
-    from alt_text_gen import is_enabled as altgen_is_enabled, generate_alt_text
+    from alt_text_gen import (
+        AdaptiveLimiter,
+        is_enabled as altgen_is_enabled,
+        generate_alt_text_async,
+        aclose as altgen_aclose,
+        start as altgen_start,
+    )
     import db
+    from atproto_session import get_client
 
 
 # ---------- Pydantic models ----------
@@ -41,14 +60,6 @@ class PostInfo(BaseModel):
     images: List[ImageInfo]
 
 
-class ScanResponse(BaseModel):
-    handle: str
-    total_posts: int
-    total_images: int
-    posts: List[PostInfo]
-    alt_generation_enabled: bool
-
-
 class AltUpdate(BaseModel):
     uri: str
     image_index: int
@@ -73,7 +84,25 @@ class ApplyResponse(BaseModel):
 
 # ---------- App setup ----------
 
-app = FastAPI(title="Bluesky Alt-Text Slinger – Phase 4")
+# Max posts whose records are fetched/rewritten concurrently in /api/apply
+APPLY_CONCURRENCY = 8
+
+# Threads for blocking work (SQLite, image resizing) run via asyncio.to_thread;
+# sized so concurrent alt-text jobs don't starve each other.
+BLOCKING_IO_WORKERS = 32
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    executor = ThreadPoolExecutor(max_workers=BLOCKING_IO_WORKERS)
+    asyncio.get_running_loop().set_default_executor(executor)
+    altgen_start()
+    yield
+    await altgen_aclose()
+    executor.shutdown(wait=False)
+
+
+app = FastAPI(title="Bluesky Alt-Text Slinger – Phase 4", lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",
@@ -116,105 +145,234 @@ def parse_at_uri(uri: str):
     return did, collection, rkey
 
 
+def blob_cid(record, image_index: int) -> Optional[str]:
+    """
+    Return the blob CID of the image at image_index in a post record's
+    app.bsky.embed.images embed, or None if it can't be found.
+    """
+    try:
+        blob = record.embed.images[image_index].image
+    except (AttributeError, IndexError, TypeError):
+        return None
+    ref = getattr(blob, "ref", None)
+    link = getattr(ref, "link", None)
+    if link:
+        return str(link)
+    cid = getattr(blob, "cid", None)
+    return str(cid) if cid else None
+
+
+async def iter_author_feed(client: AsyncClient, actor: str) -> AsyncIterator:
+    """
+    Yield pages of an author feed, requesting the next page in the
+    background while the caller processes the current one.
+    """
+    next_page = asyncio.create_task(client.get_author_feed(actor=actor))
+    try:
+        while next_page is not None:
+            try:
+                feed = await next_page
+            except Exception as e:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Error fetching author feed: {e}",
+                )
+
+            next_page = None
+            if feed.cursor:
+                next_page = asyncio.create_task(
+                    client.get_author_feed(actor=actor, cursor=feed.cursor)
+                )
+
+            yield feed
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+            # A prefetch that already failed can't be cancelled; retrieve its
+            # error so asyncio doesn't log it as never retrieved.
+            if next_page.done() and not next_page.cancelled():
+                next_page.exception()
+
+
+def parse_feed_page(
+    feed, altgen_active: bool
+) -> Tuple[List[PostInfo], Dict[Tuple[str, int], Tuple[str, str, Optional[str]]]]:
+    """
+    Extract posts with image embeds from one author-feed page.
+
+    Returns the posts plus, when altgen_active, the images lacking alt text
+    as (post_uri, image_index) -> (fullsize_url, post_text, blob_cid).
+    """
+    posts_with_images: List[PostInfo] = []
+    missing_alt: Dict[Tuple[str, int], Tuple[str, str, Optional[str]]] = {}
+
+    for item in feed.feed:
+        post = item.post
+        record = post.record
+        uri = post.uri
+        cid = post.cid
+
+        embed = getattr(post, "embed", None)
+        if not embed or getattr(embed, "$type", "") != "app.bsky.embed.images#view":
+            continue
+
+        text = getattr(record, "text", "") or ""
+        created_at = getattr(record, "created_at", None)
+
+        images: List[ImageInfo] = []
+        for idx, img in enumerate(embed.images):
+            alt = img.alt if hasattr(img, "alt") else None
+            thumb_url = img.thumb
+            fullsize_url = img.fullsize
+
+            if altgen_active and (not alt or not alt.strip()):
+                missing_alt[(uri, idx)] = (fullsize_url, text, blob_cid(record, idx))
+
+            images.append(
+                ImageInfo(
+                    index=idx,
+                    thumb_url=thumb_url,
+                    fullsize_url=fullsize_url,
+                    alt=alt,
+                )
+            )
+
+        posts_with_images.append(
+            PostInfo(
+                uri=uri,
+                cid=cid,
+                text=text,
+                created_at=created_at,
+                images=images,
+            )
+        )
+
+    return posts_with_images, missing_alt
+
+
+def _ndjson(obj: dict) -> bytes:
+    return orjson.dumps(obj) + b"\n"
+
+
 # ---------- /api/scan ----------
 
-@app.post("/api/scan", response_model=ScanResponse)
-def scan_images(req: ScanRequest) -> ScanResponse:
-    client = Client()
+@app.post("/api/scan")
+async def scan_images(req: ScanRequest) -> StreamingResponse:
+    """
+    Scan the user's posts, streaming results as NDJSON one feed page at a
+    time so the frontend can render progressively. Lines are:
 
+      {"handle": ..., "alt_generation_enabled": ...}   first
+      {"posts": [PostInfo, ...]}                        one per page
+      {"total_posts": ..., "total_images": ...}         last, on success
+      {"error": ...}                                    last, on failure
+    """
     try:
-        client.login(req.handle, req.app_password)
+        client = await get_client(req.handle, req.app_password)
     except Exception as e:
         raise HTTPException(
             status_code=401,
             detail="Failed to login to Bluesky. Check handle/app password.",
         ) from e
 
-    posts_with_images: List[PostInfo] = []
-    cursor = None
-
     altgen_active = altgen_is_enabled() and req.generate_alt
 
-    while True:
-        try:
-            feed = client.get_author_feed(actor=req.handle, cursor=cursor)
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error fetching author feed: {e}",
-            )
+    async def _gen() -> AsyncIterator[bytes]:
+        limiter = AdaptiveLimiter()
+        # Suggestions generated so far, keyed by blob CID (or fullsize URL),
+        # so an image repeated across posts/pages is only sent to OpenAI once.
+        generated_by_image: Dict[str, Optional[str]] = {}
+        total_posts = 0
+        total_images = 0
 
-        for item in feed.feed:
-            post = item.post
-            record = post.record
-            uri = post.uri
-            cid = post.cid
-
-            embed = getattr(post, "embed", None)
-            if not embed or getattr(embed, "$type", "") != "app.bsky.embed.images#view":
-                continue
-
-            text = getattr(record, "text", "") or ""
-            created_at = getattr(record, "created_at", None)
-
-            images: List[ImageInfo] = []
-            for idx, img in enumerate(embed.images):
-                alt = img.alt if hasattr(img, "alt") else None
-                thumb_url = img.thumb
-                fullsize_url = img.fullsize
-
-                generated_alt: Optional[str] = None
-                if altgen_active and (not alt or not alt.strip()):
-                    generated_alt = generate_alt_text(fullsize_url, text)
-
-                images.append(
-                    ImageInfo(
-                        index=idx,
-                        thumb_url=thumb_url,
-                        fullsize_url=fullsize_url,
-                        alt=alt,
-                        generated_alt=generated_alt,
+        yield _ndjson(
+            {"handle": req.handle, "alt_generation_enabled": altgen_active}
+        )
+
+        try:
+            # aclosing() cancels the prefetched page if this loop exits early
+            async with aclosing(iter_author_feed(client, req.handle)) as feeds:
+                async for feed in feeds:
+                    page_posts, missing_alt = parse_feed_page(feed, altgen_active)
+                    if not page_posts:
+                        continue
+
+                    # image key -> (fullsize_url, post_text, blob_cid) from the
+                    # image's first occurrence on this page
+                    altgen_jobs: Dict[str, Tuple[str, str, Optional[str]]] = {}
+                    altgen_targets: Dict[Tuple[str, int], str] = {}
+                    for target, (url, text, image_cid) in missing_alt.items():
+                        image_key = image_cid or url
+                        if image_key not in generated_by_image:
+                            altgen_jobs.setdefault(image_key, (url, text, image_cid))
+                        altgen_targets[target] = image_key
+
+                    if altgen_jobs:
+                        generated = await asyncio.gather(
+                            *[
+                                generate_alt_text_async(
+                                    url, text, limiter=limiter, image_cid=image_cid
+                                )
+                                for url, text, image_cid in altgen_jobs.values()
+                            ]
+                        )
+                        generated_by_image.update(zip(altgen_jobs, generated))
+
+                    # Fill in suggestions and build the SQLite rows in one pass
+                    post_rows = []
+                    image_rows = []
+                    for p in page_posts:
+                        post_rows.append(
+                            (req.handle, p.uri, p.cid, p.text, p.created_at)
+                        )
+                        for img in p.images:
+                            image_key = altgen_targets.get((p.uri, img.index))
+                            if image_key is not None:
+                                img.generated_alt = generated_by_image[image_key]
+                            image_rows.append(
+                                (
+                                    req.handle,
+                                    p.uri,
+                                    img.index,
+                                    img.thumb_url,
+                                    img.fullsize_url,
+                                    img.alt,
+                                    img.generated_alt,
+                                )
+                            )
+
+                    # Persist this page to SQLite before sending it on
+                    await asyncio.to_thread(
+                        db.save_scan_page, req.handle, post_rows, image_rows
                     )
-                )
 
-            posts_with_images.append(
-                PostInfo(
-                    uri=uri,
-                    cid=cid,
-                    text=text,
-                    created_at=created_at,
-                    images=images,
-                )
-            )
+                    page = [p.model_dump() for p in page_posts]
 
-        cursor = feed.cursor
-        if not cursor:
-            break
+                    total_posts += len(page_posts)
+                    total_images += sum(len(p.images) for p in page_posts)
+                    yield _ndjson({"posts": page})
 
-    total_images = sum(len(p.images) for p in posts_with_images)
+        except HTTPException as e:
+            yield _ndjson({"error": e.detail})
+            return
+        except Exception as e:
+            yield _ndjson({"error": f"Error during scan: {e}"})
+            return
 
-    # Persist scan results to SQLite
-    db.save_scan(req.handle, [p.model_dump() for p in posts_with_images])
+        yield _ndjson({"total_posts": total_posts, "total_images": total_images})
 
-    return ScanResponse(
-        handle=req.handle,
-        total_posts=len(posts_with_images),
-        total_images=total_images,
-        posts=posts_with_images,
-        alt_generation_enabled=altgen_active,
-    )
+    return StreamingResponse(_gen(), media_type="application/x-ndjson")
 
 
 # ---------- /api/apply ----------
 
 @app.post("/api/apply", response_model=ApplyResponse)
-def apply_alt_updates(req: ApplyRequest) -> ApplyResponse:
+async def apply_alt_updates(req: ApplyRequest) -> ApplyResponse:
     if not req.updates:
         return ApplyResponse(updated=[])
 
-    client = Client()
     try:
-        client.login(req.handle, req.app_password)
+        client = await get_client(req.handle, req.app_password)
     except Exception as e:
         raise HTTPException(
             status_code=401,
@@ -225,86 +383,84 @@ def apply_alt_updates(req: ApplyRequest) -> ApplyResponse:
     for upd in req.updates:
         updates_by_uri.setdefault(upd.uri, []).append(upd)
 
-    results: List[ApplyResultItem] = []
+    sem = asyncio.Semaphore(APPLY_CONCURRENCY)
+
+    # (handle, uri, image_index, new_alt, status) rows, written in one batch
+    db_rows: List[Tuple[str, str, int, str, str]] = []
 
-    for uri, updates in updates_by_uri.items():
+    async def _apply_one(uri: str, updates: List[AltUpdate]) -> ApplyResultItem:
         try:
             did, collection, rkey = parse_at_uri(uri)
 
-            rec_resp = client.com.atproto.repo.get_record(
-                repo=did,
-                collection=collection,
-                rkey=rkey,
-            )
-
-            record = getattr(rec_resp, "value", None)
-            if record is None:
-                if isinstance(rec_resp, dict) and "value" in rec_resp:
-                    record = rec_resp["value"]
-                else:
-                    raise RuntimeError("Could not locate record value in response")
-
-            embed = record.get("embed")
-            if not embed:
-                raise RuntimeError("Record has no embed")
-            if embed.get("$type") != "app.bsky.embed.images":
-                raise RuntimeError(
-                    f"Embed type is not app.bsky.embed.images: {embed.get('$type')}"
+            async with sem:
+                rec_resp = await client.com.atproto.repo.get_record(
+                    repo=did,
+                    collection=collection,
+                    rkey=rkey,
                 )
 
-            images = embed.get("images") or []
-            if not isinstance(images, list):
-                raise RuntimeError("Record embed.images is not a list")
-
-            # Apply updates
-            for upd in updates:
-                idx = upd.image_index
-                if idx < 0 or idx >= len(images):
-                    continue
-                images[idx]["alt"] = upd.new_alt
-
-            client.com.atproto.repo.put_record(
-                repo=did,
-                collection=collection,
-                rkey=rkey,
-                record=record,
-            )
+                record = getattr(rec_resp, "value", None)
+                if record is None:
+                    if isinstance(rec_resp, dict) and "value" in rec_resp:
+                        record = rec_resp["value"]
+                    else:
+                        raise RuntimeError("Could not locate record value in response")
+
+                embed = record.get("embed")
+                if not embed:
+                    raise RuntimeError("Record has no embed")
+                if embed.get("$type") != "app.bsky.embed.images":
+                    raise RuntimeError(
+                        f"Embed type is not app.bsky.embed.images: {embed.get('$type')}"
+                    )
 
-            # Record each update in SQLite as "applied"
-            for upd in updates:
-                db.record_image_update(
-                    handle=req.handle,
-                    uri=uri,
-                    image_index=upd.image_index,
-                    new_alt=upd.new_alt,
-                    status="applied",
+                images = embed.get("images") or []
+                if not isinstance(images, list):
+                    raise RuntimeError("Record embed.images is not a list")
+
+                # Apply updates
+                for upd in updates:
+                    idx = upd.image_index
+                    if idx < 0 or idx >= len(images):
+                        continue
+                    images[idx]["alt"] = upd.new_alt
+
+                await client.com.atproto.repo.put_record(
+                    repo=did,
+                    collection=collection,
+                    rkey=rkey,
+                    record=record,
                 )
 
-            results.append(
-                ApplyResultItem(
-                    uri=uri,
-                    success=True,
-                    error=None,
-                )
+            # Record each update as "applied" (flushed to SQLite below)
+            db_rows.extend(
+                (req.handle, uri, upd.image_index, upd.new_alt, "applied")
+                for upd in updates
+            )
+
+            return ApplyResultItem(
+                uri=uri,
+                success=True,
+                error=None,
             )
 
         except Exception as e:
             # Record failed updates
-            for upd in updates:
-                db.record_image_update(
-                    handle=req.handle,
-                    uri=uri,
-                    image_index=upd.image_index,
-                    new_alt=upd.new_alt,
-                    status="failed",
-                )
+            db_rows.extend(
+                (req.handle, uri, upd.image_index, upd.new_alt, "failed")
+                for upd in updates
+            )
 
-            results.append(
-                ApplyResultItem(
-                    uri=uri,
-                    success=False,
-                    error=str(e),
-                )
+            return ApplyResultItem(
+                uri=uri,
+                success=False,
+                error=str(e),
             )
 
+    results: List[ApplyResultItem] = await asyncio.gather(
+        *[_apply_one(uri, updates) for uri, updates in updates_by_uri.items()]
+    )
+
+    await asyncio.to_thread(db.record_image_updates_bulk, db_rows)
+
     return ApplyResponse(updated=results)
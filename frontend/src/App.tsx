@@ -43,20 +43,25 @@ const App: React.FC = () => {
   const [altState, setAltState] = useState<AltStateMap>({});
   const [filterMode, setFilterMode] = useState<FilterMode>("all");
 
+  // Called for every streamed page; only images not seen yet get initial
+  // state, so edits made while the scan is still running are kept.
   const initAltStateFromResult = (data: ScanResponse) => {
-    const next: AltStateMap = {};
-    data.posts.forEach((post) => {
-      post.images.forEach((img) => {
-        const key = makeKey(post.uri, img.index);
-        const baseAlt =
-          img.alt && img.alt.trim().length > 0 ? img.alt : img.generated_alt || "";
-        next[key] = {
-          apply: !img.alt || img.alt.trim().length === 0, // default: auto-select only images with no existing alt
-          draftAlt: baseAlt
-        };
+    setAltState((prev) => {
+      const next: AltStateMap = { ...prev };
+      data.posts.forEach((post) => {
+        post.images.forEach((img) => {
+          const key = makeKey(post.uri, img.index);
+          if (next[key]) return;
+          const baseAlt =
+            img.alt && img.alt.trim().length > 0 ? img.alt : img.generated_alt || "";
+          next[key] = {
+            apply: !img.alt || img.alt.trim().length === 0, // default: auto-select only images with no existing alt
+            draftAlt: baseAlt
+          };
+        });
       });
+      return next;
     });
-    setAltState(next);
   };
 
   const onSubmit = async (e: React.FormEvent) => {
@@ -73,13 +78,18 @@ const App: React.FC = () => {
 
     setLoading(true);
     try {
-      const data = await scanImages({
-        handle,
-        app_password: appPassword,
-        generate_alt: true
-      });
-      setResult(data);
-      initAltStateFromResult(data);
+      const onProgress = (data: ScanResponse) => {
+        setResult(data);
+        initAltStateFromResult(data);
+      };
+      await scanImages(
+        {
+          handle,
+          app_password: appPassword,
+          generate_alt: true
+        },
+        onProgress
+      );
     } catch (err: any) {
       console.error(err);
       let msg = "An error occurred while scanning.";
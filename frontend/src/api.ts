@@ -30,7 +30,19 @@ export interface ScanResponse {
 
 const API_BASE = "http://localhost:8000";
 
-export async function scanImages(req: ScanRequest): Promise<ScanResponse> {
+// /api/scan streams NDJSON: a header line, one line per feed page, then a
+// summary (or error) line. onProgress receives the accumulated result after
+// each line so the UI can render pages as they arrive.
+type ScanStreamLine =
+  | { handle: string; alt_generation_enabled: boolean }
+  | { posts: PostInfo[] }
+  | { total_posts: number; total_images: number }
+  | { error: string };
+
+export async function scanImages(
+  req: ScanRequest,
+  onProgress?: (partial: ScanResponse) => void
+): Promise<ScanResponse> {
   const res = await fetch(`${API_BASE}/api/scan`, {
     method: "POST",
     headers: {
@@ -42,12 +54,58 @@ export async function scanImages(req: ScanRequest): Promise<ScanResponse> {
     })
   });
 
-  if (!res.ok) {
+  if (!res.ok || !res.body) {
     const text = await res.text();
     throw new Error(text || `HTTP error ${res.status}`);
   }
 
-  return res.json();
+  let result: ScanResponse = {
+    handle: req.handle,
+    total_posts: 0,
+    total_images: 0,
+    posts: [],
+    alt_generation_enabled: false
+  };
+
+  const handleLine = (line: string) => {
+    if (!line.trim()) return;
+    const msg = JSON.parse(line) as ScanStreamLine;
+    if ("error" in msg) {
+      throw new Error(msg.error);
+    }
+    if ("posts" in msg) {
+      result = {
+        ...result,
+        posts: [...result.posts, ...msg.posts],
+        total_posts: result.total_posts + msg.posts.length,
+        total_images:
+          result.total_images +
+          msg.posts.reduce((n, post) => n + post.images.length, 0)
+      };
+    } else {
+      result = { ...result, ...msg };
+    }
+    onProgress?.(result);
+  };
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let newline: number;
+    while ((newline = buffer.indexOf("\n")) >= 0) {
+      handleLine(buffer.slice(0, newline));
+      buffer = buffer.slice(newline + 1);
+    }
+  }
+  handleLine(buffer + decoder.decode());
+
+  return result;
 }
 
 // ---------- Phase 3 apply ----------